@@ -1,11 +1,28 @@
 import os
-import json
-from typing import Any, Dict, Optional, List
-
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import re
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import functools
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Literal, Tuple
+from urllib.parse import urlsplit
+
+import anyio
+from cachetools import TTLCache
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pypdf import PdfReader
-from openai import OpenAI
+from pydantic import BaseModel, ConfigDict, ValidationError
+import pypdfium2 as pdfium
+import tiktoken
+import httpx
+from openai import AsyncOpenAI
 
 # -------------------------
 # Config
@@ -13,12 +30,71 @@ from openai import OpenAI
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5-mini")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Cap resume size for MVP cost control: chars bound extraction, tokens bound what the model is billed for
+MAX_RESUME_CHARS = 50000
+MAX_RESUME_TOKENS = 12000
+MAX_PDF_PAGES = 40
+MAX_PDF_BYTES = 10_000_000
+HEADER_FOOTER_LINES = 2
+
 if not OPENAI_API_KEY:
     raise RuntimeError("OPENAI_API_KEY is not set")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Async client so the LLM call doesn't block the event loop; one shared pooled HTTP/2 connection set
+client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    timeout=60,
+    max_retries=2,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        # Keep idle connections well past httpx's 5s default so bursts reuse the warm session
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=120),
+    ),
+)
+
+# Bump whenever SYSTEM_PROMPT / build_user_prompt / RESPONSE_SCHEMA change so cached results are not reused
+PROMPT_VERSION = "2"
+
+# In-process cache of validated results, keyed by analysis_cache_key(); per worker
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+analysis_cache: TTLCache = TTLCache(maxsize=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL)
+
+# Extracted, truncated resume text keyed by sha256 of the PDF bytes, so re-running a CV against other positions skips extraction
+pdf_text_cache: TTLCache = TTLCache(maxsize=256, ttl=900)
+pdfium_lock = threading.Lock()
+
+# Request handlers only enqueue log records; a background thread writes them to stderr
+log_queue: queue.Queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+atexit.register(log_listener.stop)
+
+log = logging.getLogger("resume_analyzer")
+log.addHandler(QueueHandler(log_queue))
+log.setLevel(logging.INFO)
+log.propagate = False
+
+
+# Warm the tokenizer (downloaded on first use) and the OpenAI connection pool so the first request isn't cold.
+# Both steps are time-boxed: uvicorn doesn't accept connections until startup finishes.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        with anyio.fail_after(10):
+            # Abandon (not wait for) a slow download; the lru_cache still fills when it completes
+            await anyio.to_thread.run_sync(get_tokenizer, abandon_on_cancel=True)
+    except Exception as e:
+        log.warning("tokenizer warmup failed: %r", e)
+    try:
+        await client.with_options(timeout=5, max_retries=0).models.retrieve(OPENAI_MODEL)
+    except Exception as e:
+        log.warning("OpenAI warmup failed: %s", e)
+    yield
+    await client.close()
 
-app = FastAPI(title="Resume Analyzer API")
+
+app = FastAPI(title="Resume Analyzer API", lifespan=lifespan)
 
 # -------------------------
 # CORS
@@ -38,177 +114,305 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
+    # Let browsers cache preflights (Chromium caps this at 2h)
+    max_age=86400,
 )
 
+# -------------------------
+# Result schema
+# -------------------------
+class Evidence(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    claim: str
+    snippet: str
+
+
+class AnalysisResult(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    fit_level: Literal["Strong", "Medium", "Low"]
+    suitable: bool
+    confidence: Literal["High", "Medium", "Low"]
+    summary: str
+    matched_required_skills: List[str]
+    missing_required_skills: List[str]
+    matched_nice_to_have: List[str]
+    missing_nice_to_have: List[str]
+    risk_flags: List[str]
+    evidence: List[Evidence]
+    screening_recommendation: Literal["Proceed to technical interview", "Recruiter screen only", "Reject"]
+    interview_focus_areas: List[str]
+    final_verdict: str
+    final_why: List[str]
+
+
 # -------------------------
 # Helpers
 # -------------------------
-def extract_text_from_pdf(file_obj) -> str:
-    try:
-        reader = PdfReader(file_obj)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"PDF_READ_FAILED: {e}")
+def extract_text_from_pdf(data: bytes, cap: int = MAX_RESUME_CHARS) -> str:
+    # PDFium is not thread-safe, even across separate documents
+    with pdfium_lock:
+        try:
+            pdf = pdfium.PdfDocument(data)
+        except pdfium.PdfiumError as e:
+            raise HTTPException(status_code=400, detail=f"PDF_READ_FAILED: {e}")
+        try:
+            return _extract_pdf_pages(pdf, cap)
+        finally:
+            pdf.close()
 
-    parts: List[str] = []
-    for page in reader.pages:
+
+def _extract_pdf_pages(pdf: pdfium.PdfDocument, cap: int) -> str:
+    page_count = len(pdf)
+    if page_count > MAX_PDF_PAGES:
+        raise HTTPException(status_code=400, detail=f"PDF_TOO_LONG: more than {MAX_PDF_PAGES} pages")
+
+    def page_text(i: int) -> str:
         try:
-            parts.append(page.extract_text() or "")
-        except Exception:
-            parts.append("")
-    return "\n".join(parts)
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                return textpage.get_text_range().replace("\r\n", "\n")
+            finally:
+                textpage.close()
+                page.close()
+        except pdfium.PdfiumError:
+            return ""
+
+    # Probe the first pages so scans are rejected before parsing the whole document
+    probe = [page_text(i) for i in range(min(2, page_count))]
+    if sum(len(t.strip()) for t in probe) < 50:
+        raise HTTPException(status_code=400, detail="NO_EXTRACTABLE_TEXT: looks like scan")
+
+    # Stop extracting once the cap is reached; the rest would be truncated anyway
+    parts: List[str] = []
+    n = 0
+    for i in range(page_count):
+        t = probe[i] if i < len(probe) else page_text(i)
+        parts.append(t)
+        n += len(t) + 1
+        if n >= cap:
+            break
+    return "\n".join(drop_repeated_lines(parts))[:cap]
+
+
+def _header_footer_zones(lines: List[str]) -> Tuple[List[int], List[int]]:
+    # Up to HEADER_FOOTER_LINES non-blank lines at each end of a page; the zones never overlap
+    idx = [i for i, line in enumerate(lines) if line.strip()]
+    k = min(HEADER_FOOTER_LINES, len(idx) // 2)
+    return idx[:k], idx[len(idx) - k:]
+
+
+def drop_repeated_lines(pages: List[str]) -> List[str]:
+    # A top/bottom line repeated at the same end of at least half the pages (min 3) is a running header/footer;
+    # interior lines are never candidates, so repeated labels like "Responsibilities:" survive
+    split = [page.splitlines() for page in pages]
+    zones = [_header_footer_zones(lines) for lines in split]
+    drop = [set() for _ in split]
+    if len(pages) >= 3:
+        threshold = max(3, -(-len(pages) // 2))
+        for side in (0, 1):
+            counts = Counter(
+                norm
+                for lines, z in zip(split, zones)
+                for norm in {lines[i].strip().lower() for i in z[side]}
+            )
+            common = {norm for norm, c in counts.items() if c >= threshold}
+            for lines, z, d in zip(split, zones, drop):
+                d.update(i for i in z[side] if lines[i].strip().lower() in common)
+
+    out: List[str] = []
+    for lines, d in zip(split, drop):
+        kept: List[str] = []
+        prev = None
+        for i, line in enumerate(lines):
+            norm = line.strip().lower()
+            if norm and (i in d or norm == prev):
+                continue
+            kept.append(line)
+            if norm:
+                prev = norm
+        out.append("\n".join(kept))
+    return out
+
+
+# Low-signal resume boilerplate, stripped before token truncation so the budget keeps useful text
+SPACES_RE = re.compile(r"[ \t\f\v]+")
+LINE_EDGE_SPACES_RE = re.compile(r" *\n *")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+PAGE_NUMBER_RE = re.compile(r"^(?:Page \d+(?: of \d+)?|\d+ of \d+)$", re.MULTILINE | re.IGNORECASE)
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# Phone-shaped only: a phone label, "+<country code>" with at least two digit groups, or
+# "(<area code>) ddd(d) dddd"; bare digit runs are left alone
+PHONE_RE = re.compile(
+    r"(?P<label>\b(?:phone|tel|mobile|mob|cell)\b\.?:?[ \t]*)"
+    r"(?:\+\d{1,3}[ .-]?)?(?:\(\d{1,4}\)[ .-]?)?\d{2,8}(?:[ .-]\d{2,8}){0,3}(?!\w)"
+    r"|(?<![\w+])\+\d{1,3}[ .-]?(?:\(\d{1,4}\)[ .-]?)?\d{2,8}(?:[ .-]\d{2,8}){1,3}(?!\w)"
+    r"|(?<![\w(])\(\d{2,4}\)[ .-]?\d{3,4}[ .-]?\d{4}(?!\w)",
+    re.IGNORECASE,
+)
+YEAR_RANGE_RE = re.compile(r"(?<![\d.-])(?:19|20)\d{2} ?[-\u2013/] ?(?:19|20)\d{2}(?!\d)")
+URL_RE = re.compile(r"(?:https?://|www\.)\S+", re.IGNORECASE)
+
+
+def _shorten_url(m: re.Match) -> str:
+    url = m.group(0)
+    if len(url) <= 40:
+        return url
+    return urlsplit(url if "://" in url else "//" + url).netloc or url
+
+
+# PHONE_RE / _mask_phone examples (as seen through compress_resume_text):
+#   "Software Engineer 01.2019 - 12.2021"        -> unchanged
+#   "2019.01 - 2021.12 Acme"                     -> unchanged
+#   "M.Sc. Computer Science (2014) 2012 - 2014"  -> unchanged
+#   "Lead (2020) 2020 - 2023"                    -> unchanged
+#   "Lead (2020) 2020-2023"                      -> unchanged
+#   "Acme GmbH (3) 2019-2021"                    -> unchanged
+#   "+1 2019-2021 (Acme)"                        -> unchanged
+#   "Mobile (2020) 2020-2023"                    -> unchanged
+#   "Server 192.168.100.200"                     -> unchanged
+#   "ISBN 978-3-16-148410-0"                     -> unchanged
+#   "+1 (415) 555-0134"                          -> "<PHONE>"
+#   "(415) 555-0134"                             -> "<PHONE>"
+#   "+44 20 7946 0958"                           -> "<PHONE>"
+#   "+49 (0)30 1234567"                          -> "<PHONE>"
+#   "Phone: 415.555.0134"                        -> "Phone: <PHONE>"
+#   "Tel 030 1234 5678"                          -> "Tel <PHONE>"
+def _mask_phone(m: re.Match) -> str:
+    label = m.group("label") or ""
+    digits = sum(c.isdigit() for c in m.group(0))
+    if not 9 <= digits <= 15 or YEAR_RANGE_RE.search(m.group(0)):
+        return m.group(0)
+    return label + "<PHONE>"
+
+
+def compress_resume_text(text: str) -> str:
+    text = SPACES_RE.sub(" ", text)
+    text = LINE_EDGE_SPACES_RE.sub("\n", text)
+    text = PAGE_NUMBER_RE.sub("", text)
+    text = URL_RE.sub(_shorten_url, text)
+    text = EMAIL_RE.sub("<EMAIL>", text)
+    text = PHONE_RE.sub(_mask_phone, text)
+    text = BLANK_LINES_RE.sub("\n\n", text)
+    return text.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer() -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(OPENAI_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+# tiktoken downloads its BPE file on first use; after a failed load, wait before trying again
+TOKENIZER_RETRY_SECONDS = 300
+tokenizer_retry_at = 0.0
 
 
-def try_parse_json(s: str) -> Optional[Dict[str, Any]]:
+def truncate_to_tokens(text: str, limit: int = MAX_RESUME_TOKENS) -> str:
+    global tokenizer_retry_at
+    if time.monotonic() < tokenizer_retry_at:
+        return text
     try:
-        obj = json.loads(s)
-        return obj if isinstance(obj, dict) else None
-    except Exception:
-        return None
-
-
-def ensure_list_of_str(value: Any) -> bool:
-    return isinstance(value, list) and all(isinstance(x, str) for x in value)
-
-
-def validate_result(obj: Dict[str, Any]) -> None:
-    required_keys = [
-        "fit_level",
-        "suitable",
-        "confidence",
-        "summary",
-        "matched_required_skills",
-        "missing_required_skills",
-        "matched_nice_to_have",
-        "missing_nice_to_have",
-        "risk_flags",
-        "evidence",
-        "screening_recommendation",
-        "interview_focus_areas",
-        "final_verdict",
-        "final_why",
-    ]
-    for k in required_keys:
-        if k not in obj:
-            raise ValueError(f"Missing key: {k}")
-
-    if obj["fit_level"] not in ("Strong", "Medium", "Low"):
-        raise ValueError("fit_level invalid")
-    if obj["confidence"] not in ("High", "Medium", "Low"):
-        raise ValueError("confidence invalid")
-    if obj["screening_recommendation"] not in (
-        "Proceed to technical interview",
-        "Recruiter screen only",
-        "Reject",
-    ):
-        raise ValueError("screening_recommendation invalid")
-
-    if not isinstance(obj["suitable"], bool):
-        raise ValueError("suitable must be boolean")
-
-    if not isinstance(obj["summary"], str):
-        raise ValueError("summary must be string")
-    if not isinstance(obj["final_verdict"], str):
-        raise ValueError("final_verdict must be string")
-
-    for lk in [
-        "matched_required_skills",
-        "missing_required_skills",
-        "matched_nice_to_have",
-        "missing_nice_to_have",
-        "risk_flags",
-        "interview_focus_areas",
-        "final_why",
-    ]:
-        if not ensure_list_of_str(obj[lk]):
-            raise ValueError(f"{lk} must be list[str]")
-
-    if not isinstance(obj["evidence"], list):
-        raise ValueError("evidence must be list")
-    for e in obj["evidence"]:
-        if not isinstance(e, dict) or "claim" not in e or "snippet" not in e:
-            raise ValueError("evidence items must be objects with claim/snippet")
-        if not isinstance(e["claim"], str) or not isinstance(e["snippet"], str):
-            raise ValueError("evidence claim/snippet must be strings")
+        enc = get_tokenizer()
+    except Exception as e:
+        # Text is still bounded by MAX_RESUME_CHARS from extraction
+        tokenizer_retry_at = time.monotonic() + TOKENIZER_RETRY_SECONDS
+        log.warning("tokenizer unavailable, using MAX_RESUME_CHARS cap only: %r", e)
+        return text
+    ids = enc.encode(text, disallowed_special=())
+    if len(ids) <= limit:
+        return text
+    return enc.decode(ids[:limit])
+
+
+def prepare_resume_text(data: bytes) -> str:
+    return truncate_to_tokens(compress_resume_text(extract_text_from_pdf(data)))
+
+
+def analysis_cache_key(title: str, position_description: str, resume_text: str) -> str:
+    h = hashlib.sha256()
+    desc = normalize_description(position_description)
+    for part in (OPENAI_MODEL, PROMPT_VERSION, title, desc, resume_text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# Streams the reply so the call can be abandoned as soon as the client disconnects
+async def stream_completion(request: Request, user_prompt: str) -> Tuple[str, str]:
+    content: List[str] = []
+    refusal: List[str] = []
+    stream = await client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+        response_format=RESPONSE_FORMAT,
+        stream=True,
+    )
+    async with stream:
+        async for chunk in stream:
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="CLIENT_DISCONNECTED")
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content.append(delta.content)
+            if delta.refusal:
+                refusal.append(delta.refusal)
+    return "".join(content), "".join(refusal)
 
 
 # -------------------------
 # Prompting
 # -------------------------
-SCHEMA_HINT = {
-    "fit_level": "Strong|Medium|Low",
-    "suitable": True,
-    "confidence": "High|Medium|Low",
-    "summary": "",
-    "matched_required_skills": [],
-    "missing_required_skills": [],
-    "matched_nice_to_have": [],
-    "missing_nice_to_have": [],
-    "risk_flags": [],
-    "evidence": [{"claim": "", "snippet": ""}],
-    "screening_recommendation": "Proceed to technical interview | Recruiter screen only | Reject",
-    "interview_focus_areas": [],
-    "final_verdict": "",
-    "final_why": [],
+# Single source of truth: the same model drives the OpenAI schema and response validation
+RESPONSE_SCHEMA = AnalysisResult.model_json_schema()
+
+# Structured outputs: the model is constrained to RESPONSE_SCHEMA, so no repair round-trip is needed
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "resume_analysis", "schema": RESPONSE_SCHEMA, "strict": True},
 }
 
-SYSTEM_PROMPT = """You are an AI recruiting assistant helping recruiters pre-screen candidates.
+SYSTEM_PROMPT = (
+    "Recruiter pre-screener. Return JSON only. Evidence snippets must be verbatim "
+    "<=25-word resume excerpts. Do not invent facts."
+)
+
+
+# Constant tail of the user prompt, built once at import
+PROMPT_GUIDELINES = (
+    "fit:Strong=meets most required w/ evidence;Medium=partial,trainable gaps;Low=major gaps. "
+    "suitable=true only if required gaps minor. conf:High/Medium/Low by resume clarity. "
+    "rec must align with suitable.\n"
+    "If description empty, infer typical requirements from title and say so in summary.\n"
+    "summary 2-4 sent; final_verdict 1 sent; final_why 2-4; lists: matched_req 4-8, missing_req 2-8, "
+    "matched_nice 0-4, missing_nice 0-4, risks 0-6, evidence 2-6, focus 3-7. English.\n"
+)
 
-You must:
-- Return VALID JSON only (no markdown, no extra text).
-- Be evidence-driven: evidence snippets must be direct excerpts from the resume text (<= 25 words).
-- Do NOT invent facts or experience.
-- Be concise and useful for recruiter decisions.
-"""
+
+def normalize_description(position_description: str) -> str:
+    # Shared by build_user_prompt and analysis_cache_key so equal prompts share a cache entry
+    return (position_description or "").strip() or "(empty)"
 
 
 def build_user_prompt(position_title: str, position_description: str, resume_text: str) -> str:
-    desc = (position_description or "").strip()
-    if not desc:
-        desc = "(empty)"
-
-    return f"""Position Title:
-{position_title}
-
-Position Description:
-{desc}
-
-Resume Text:
-{resume_text}
-
-Return JSON EXACTLY with this schema (same keys, same types):
-{json.dumps(SCHEMA_HINT, indent=2)}
-
-Guidelines:
-- fit_level:
-  Strong → Meets most required skills with clear evidence.
-  Medium → Partial match; some required gaps but potentially trainable.
-  Low → Major required skills missing.
-- suitable:
-  true only if required gaps are minor.
-- confidence:
-  High → Resume clearly detailed.
-  Medium → Some ambiguity.
-  Low → Insufficient clarity.
-- screening_recommendation must be one of:
-  "Proceed to technical interview"
-  "Recruiter screen only"
-  "Reject"
-- If Position Description is empty, infer typical requirements from the Position Title and mention that assumption briefly in summary.
-
-Output constraints:
-- summary: 2–4 sentences max.
-- final_verdict: EXACTLY 1 sentence. Must align with suitable + screening_recommendation.
-- final_why: 2–4 bullet points (list items) explaining WHY this verdict was chosen.
-- Keep lists concise:
-  matched_required_skills 4–8 (if possible),
-  missing_required_skills 2–8,
-  risk_flags 0–6,
-  evidence 2–6,
-  interview_focus_areas 3–7.
-All output in English.
-"""
+    desc = normalize_description(position_description)
+    return (
+        f"Position Title:\n{position_title}\n\n"
+        f"Position Description:\n{desc}\n\n"
+        f"Resume Text:\n{resume_text}\n\n"
+        + PROMPT_GUIDELINES
+    )
 
 
 # -------------------------
@@ -219,8 +423,9 @@ def health():
     return {"ok": True, "model": OPENAI_MODEL}
 
 
-@app.post("/analyze")
+@app.post("/analyze", response_model=AnalysisResult)
 async def analyze(
+    request: Request,
     position_title: str = Form(...),
     position_description: str = Form(""),
     cv_pdf: UploadFile = File(...),
@@ -232,68 +437,56 @@ async def analyze(
     if cv_pdf.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="UNSUPPORTED_FILE_TYPE: PDF only")
 
-    # 1) Extract text
-    text = extract_text_from_pdf(cv_pdf.file).strip()
+    # Starlette has already spooled the upload; check its size before pulling it into memory
+    if (cv_pdf.size or 0) > MAX_PDF_BYTES:
+        raise HTTPException(status_code=413, detail=f"FILE_TOO_LARGE: max {MAX_PDF_BYTES} bytes")
+
+    # 1) Extract text (CPU-bound; keep it off the event loop)
+    data = await cv_pdf.read()
+    pdf_key = hashlib.sha256(data).hexdigest()
+    text = pdf_text_cache.get(pdf_key)
+    if text is None:
+        text = await run_in_threadpool(prepare_resume_text, data)
+        pdf_text_cache[pdf_key] = text
     if len(text) < 300:
         raise HTTPException(status_code=400, detail="NO_EXTRACTABLE_TEXT: looks like scan")
 
-    # 2) Cap text size for MVP cost control
-    resume_text = text[:50000]
-    user_prompt = build_user_prompt(title, position_description, resume_text)
+    # 2) Same resume + position already analyzed: skip the model call
+    cache_key = analysis_cache_key(title, position_description, text)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    user_prompt = build_user_prompt(title, position_description, text)
 
     # 3) Call model (no temperature for gpt-5-mini)
     try:
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
+        content, refusal = await stream_completion(request, user_prompt)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OPENAI_CALL_FAILED: {e}")
 
-    content = (resp.choices[0].message.content or "").strip()
-    parsed = try_parse_json(content)
+    if refusal:
+        raise HTTPException(status_code=500, detail=f"ANALYSIS_FAILED: model refused: {refusal}")
 
-    # 4) Retry once if JSON invalid
-    if parsed is None:
-        try:
-            repair = f"""Your previous response was not valid JSON.
-Return ONLY valid JSON matching the schema exactly.
-Previous output:
-{content}
-"""
-            resp2 = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                    {"role": "user", "content": repair},
-                ],
-            )
-            content2 = (resp2.choices[0].message.content or "").strip()
-            parsed = try_parse_json(content2)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"OPENAI_REPAIR_FAILED: {e}")
-
-    if parsed is None:
-        raise HTTPException(status_code=500, detail="ANALYSIS_FAILED: invalid JSON from model")
-
-    # 5) Validate schema
+    # 4) Parse + validate in one pass (pydantic-core parses the JSON itself)
     try:
-        validate_result(parsed)
-    except Exception as e:
+        result = AnalysisResult.model_validate_json(content)
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" for err in e.errors()):
+            raise HTTPException(status_code=500, detail="ANALYSIS_FAILED: invalid JSON from model")
         raise HTTPException(status_code=500, detail=f"ANALYSIS_FAILED: schema validation error: {e}")
 
+    analysis_cache[cache_key] = result
+
     # Minimal log (no CV stored)
-    print(
-        {
-            "title": title,
-            "fit": parsed.get("fit_level"),
-            "suitable": parsed.get("suitable"),
-            "rec": parsed.get("screening_recommendation"),
-        }
+    log.info(
+        "analyzed title=%r fit=%s suitable=%s rec=%r",
+        title,
+        result.fit_level,
+        result.suitable,
+        result.screening_recommendation,
     )
 
-    return parsed
\ No newline at end of file
+    return result
\ No newline at end of file